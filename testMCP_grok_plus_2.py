@@ -1,12 +1,26 @@
 import asyncio
-import json
+import atexit
+import functools
+import itertools
 import os
 import random
-import uuid
-from typing import Dict, Any, Optional
+import re
+import sys
+from collections import Counter, OrderedDict
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Any, List, Optional
 
 import httpx
-from mcp import types
+import orjson
+
+try:
+    import uvloop
+except ImportError:  # uvloop не поддерживается на Windows
+    uvloop = None
+
+# mcp.types при импорте строит все pydantic-модели протокола, а тестовому прогону
+# они не нужны; модуль импортируется лениво в методах, которые возвращают модели
+if TYPE_CHECKING:
+    from mcp import types
 
 # === Настройки подключения к MCP серверу ===
 MCP_HOST = os.getenv("MCP_HOST", "127.0.0.1")
@@ -16,53 +30,211 @@ BASE_URL = f"http://{MCP_HOST}:{MCP_PORT}"
 AUTH_MODE = os.getenv("MCP_AUTH_MODE", "none")
 ACCESS_TOKEN = os.getenv("MCP_ACCESS_TOKEN", None)
 
+# Дублировать каждую запись отчёта в консоль (MCP_VERBOSE=1)
+VERBOSE = os.getenv("MCP_VERBOSE", "0") == "1"
+
+# Максимум одновременных запросов тестового прогона к серверу
+CONCURRENCY = int(os.getenv("MCP_CONCURRENCY", "16"))
+
+# Зерно генератора случайных параметров для воспроизводимого прогона; 0 - случайное
+SEED = int(os.getenv("MCP_SEED", "0")) or None
+
+# Кэш ответов read-only инструментов в пределах прогона (единственный уровень
+# дедупликации запросов); MCP_MEMO=0 отключает его, и каждый вызов идёт на сервер
+MEMO = os.getenv("MCP_MEMO", "1") != "0"
+
+# Размер пула соединений HTTP-клиента; keep-alive держится для половины соединений.
+# По http:// клиент работает по HTTP/1.1 (h2 httpx согласует только через TLS), то есть
+# одно соединение на запрос: при MCP_POOL < MCP_CONCURRENCY запросы сверх пула ждут
+# свободного соединения и завершаются PoolTimeout через 5 с
+POOL_SIZE = int(os.getenv("MCP_POOL", "64"))
+
+# Тело запроса initialize статично, поэтому сериализуется один раз при импорте
+_INIT_PAYLOAD = orjson.dumps({
+    "jsonrpc": "2.0",
+    "id": 1,
+    "method": "initialize",
+    "params": {
+        "protocolVersion": "2024-11-05",
+        "clientInfo": {
+            "name": "TestMCP",
+            "version": "1.0.0"
+        },
+        "capabilities": {}
+    }
+})
+
+
+async def _iter_sse(response: httpx.Response) -> AsyncIterator[Any]:
+    """Построчный разбор SSE-потока: JSON из полей data: каждого события message.
+
+    Событие завершается пустой строкой; комментарии (":") и поля id:/retry:
+    пропускаются. После маркера [DONE] события не выдаются, но поток дочитывается
+    до конца, чтобы соединение вернулось в пул.
+    """
+    event = ""
+    data_lines: List[str] = []
+    done = False
+    async for line in response.aiter_lines():
+        if done:
+            continue
+        if line:
+            if line.startswith(":"):
+                continue
+            field, _, value = line.partition(":")
+            if value.startswith(" "):
+                value = value[1:]
+            if field == "data":
+                data_lines.append(value)
+            elif field == "event":
+                event = value
+            continue
+
+        if data_lines:
+            data = "\n".join(data_lines)
+            if data == "[DONE]":
+                done = True
+            elif event in ("", "message"):
+                yield orjson.loads(data)
+        event = ""
+        data_lines = []
+
+    # Последнее событие могло прийти без завершающей пустой строки
+    if data_lines and not done and event in ("", "message"):
+        data = "\n".join(data_lines)
+        if data != "[DONE]":
+            yield orjson.loads(data)
+
+
+async def _read_message(response: httpx.Response) -> Any:
+    """Чтение JSON-RPC ответа из потокового ответа httpx.
+
+    SSE-поток разбирается по мере получения, без буферизации всего тела: ответом
+    считается первое событие message. Остальные ответы читаются целиком.
+    """
+    # Сравнивается только тип носителя: параметры (charset) и регистр не важны
+    media_type = response.headers.get("content-type", "").partition(";")[0].strip().lower()
+    if media_type != "text/event-stream":
+        return orjson.loads(await response.aread())
+
+    message = None
+    # Поток дочитывается до конца и после первого события: httpcore возвращает
+    # соединение HTTP/1.1 в пул, только если тело ответа получено полностью,
+    # иначе закрывает его. Сервер завершает поток сразу после ответа
+    async for item in _iter_sse(response):
+        if message is None:
+            message = item
+    if message is None:
+        return {"error": "SSE-поток завершился без ответа"}
+    return message
+
+
+# httpx.AsyncClient привязан к циклу событий, в котором открыты его соединения,
+# поэтому пул общий для всех MCPClient одного цикла, а не один на процесс
+_CLIENT_BY_LOOP: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+
+
+async def _get_client() -> httpx.AsyncClient:
+    """Общий HTTP-клиент текущего цикла событий (создаётся при первом обращении)"""
+    loop = asyncio.get_running_loop()
+    client = _CLIENT_BY_LOOP.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            # Время жизни keep-alive совпадает с таймаутом простоя nginx по умолчанию (75 с),
+            # чтобы клиент не закрывал соединения посреди прогона
+            limits=httpx.Limits(
+                max_connections=POOL_SIZE,
+                max_keepalive_connections=max(POOL_SIZE // 2, 1),
+                keepalive_expiry=75.0
+            ),
+            # Статичные заголовки задаются на уровне клиента, чтобы не собирать их
+            # заново на каждый запрос
+            headers={
+                "Content-Type": "application/json",
+                "Accept": "application/json, text/event-stream",
+                "User-Agent": "MCP-Client/1.0"
+            }
+        )
+        _CLIENT_BY_LOOP[loop] = client
+    return client
+
+
+async def _close_client():
+    """Закрывает общий HTTP-клиент текущего цикла событий"""
+    client = _CLIENT_BY_LOOP.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+@atexit.register
+def _close_clients_at_exit():
+    """Закрывает клиенты, оставшиеся открытыми к завершению процесса"""
+    for loop, client in list(_CLIENT_BY_LOOP.items()):
+        if not loop.is_closed() and not loop.is_running():
+            loop.run_until_complete(client.aclose())
+    _CLIENT_BY_LOOP.clear()
+
 
 class MCPClient:
     """Минимальный клиент для работы с MCP сервером 1С через JSON-RPC"""
 
-    def __init__(self, base_url: str, auth_token: Optional[str] = None):
+    # Инструменты только для чтения: в пределах прогона их ответы можно переиспользовать
+    CACHEABLE_TOOLS = frozenset({
+        "list_metadata_objects", "get_metadata_structure", "list_predefined_data", "get_predefined_data"
+    })
+    CACHE_MAX_SIZE = 500
+
+    # Предохранитель: после BREAKER_THRESHOLD сетевых ошибок подряд запросы
+    # BREAKER_COOLDOWN секунд не отправляются и сразу возвращают ошибку
+    BREAKER_THRESHOLD = 10
+    BREAKER_COOLDOWN = 30.0
+
+    def __init__(
+        self,
+        base_url: str,
+        auth_token: Optional[str] = None,
+        max_concurrency: int = 16,
+        request_timeout: float = 5.0,
+        use_cache: bool = True
+    ):
         self.base_url = base_url
         self.auth_token = auth_token
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self._init_url = f"{base_url}/mcp/initialize"
+        self._request_url = f"{base_url}/mcp/request"
         self.session_id: Optional[str] = None
+        # Заголовки этого клиента поверх общих: Authorization, если передан токен,
+        # и Mcp-Session-Id, который добавляется один раз после initialize
+        self._headers: Dict[str, str] = {}
+        if auth_token:
+            self._headers["Authorization"] = f"Bearer {auth_token}"
+        # Ограничение числа одновременных запросов к серверу
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # LRU-кэш ответов read-only инструментов. Хранятся задачи, а не результаты,
+        # чтобы одновременные одинаковые вызовы ждали один запрос к серверу
+        self._cache: "OrderedDict[bytes, asyncio.Future]" = OrderedDict()
+        self._use_cache = use_cache
+        # Статистика для отчёта: ответы из кэша по инструментам и отправленные на сервер POST
+        self.cache_hits: Counter = Counter()
+        self.requests_sent = 0
+        # Идентификаторы JSON-RPC: достаточно уникальности в пределах сессии,
+        # id 1 занят запросом initialize
+        self._next_id = itertools.count(2)
+        # Таймаут обычных запросов короче клиентского (30 с, нужен для initialize),
+        # чтобы зависший сервер не держал каждый запрос по полминуты
+        self._request_timeout = request_timeout
+        self._consecutive_errors = 0
+        self._breaker_open_until = 0.0
 
     async def initialize_session(self) -> bool:
         """Создаёт MCP сессию через /mcp/initialize"""
-        url = f"{self.base_url}/mcp/initialize"
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json, text/event-stream"
-        }
-
-        payload = {
-            "jsonrpc": "2.0",
-            "id": 1,
-            "method": "initialize",
-            "params": {
-                "protocolVersion": "2024-11-05",
-                "clientInfo": {
-                    "name": "TestMCP",
-                    "version": "1.0.0"
-                },
-                "capabilities": {}
-            }
-        }
-
-        if self.auth_token:
-            headers["Authorization"] = f"Bearer {self.auth_token}"
-
         try:
-            resp = await self.client.post(url, json=payload, headers=headers)
-            print("Ответ initialize:", resp.text)
-            print("Headers initialize:", dict(resp.headers))
-
-            text = resp.text.strip()
-            if text.startswith("event:"):
-                data_lines = [line[5:].strip() for line in text.split("\n") if line.startswith("data:")]
-                data_str = "\n".join(data_lines)  # Handle multi-line data if needed
-                data = json.loads(data_str)
-            else:
-                data = resp.json()
+            client = await _get_client()
+            async with client.stream("POST", self._init_url, content=_INIT_PAYLOAD, headers=self._headers) as resp:
+                print("Headers initialize:", dict(resp.headers))
+                data = await _read_message(resp)
+            print("Ответ initialize:", data)
 
             if "result" in data:
                 result = data["result"]
@@ -73,6 +245,7 @@ class MCPClient:
                 # Capture session ID from header if present
                 self.session_id = resp.headers.get("Mcp-Session-Id")
                 if self.session_id:
+                    self._headers["Mcp-Session-Id"] = self.session_id
                     print(f"Session ID assigned: {self.session_id}")
                 else:
                     print("No Mcp-Session-Id header found; proceeding without session ID.")
@@ -87,152 +260,317 @@ class MCPClient:
             return False
 
     async def _make_request(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
-        """Отправляет JSON-RPC запрос через /mcp/request"""
-        url = f"{self.base_url}/mcp/request"
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json, text/event-stream"
-        }
-
-        if self.auth_token:
-            headers["Authorization"] = f"Bearer {self.auth_token}"
-        if self.session_id:
-            headers["Mcp-Session-Id"] = self.session_id
-
+        """Отправляет JSON-RPC запрос через /mcp/request.
+
+        Ответы инструментов из CACHEABLE_TOOLS берутся из кэша по имени и аргументам,
+        если он не отключён параметром use_cache.
+        """
+        if not self._use_cache or method != "tools/call" or params.get("name") not in self.CACHEABLE_TOOLS:
+            return await self._send_request(method, params)
+
+        key = orjson.dumps(params, option=orjson.OPT_SORT_KEYS)
+        task = self._cache.get(key)
+        if task is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits[params["name"]] += 1
+        else:
+            task = asyncio.ensure_future(self._send_request(method, params))
+            self._cache[key] = task
+            if len(self._cache) > self.CACHE_MAX_SIZE:
+                self._cache.popitem(last=False)
+
+        response = await task
+        # Ошибки не кэшируются: следующий такой же вызов снова пойдёт на сервер
+        if "error" in response and self._cache.get(key) is task:
+            del self._cache[key]
+        return response
+
+    async def _send_request(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Отправляет JSON-RPC запрос через /mcp/request без кэширования"""
         payload = {
             "jsonrpc": "2.0",
-            "id": str(uuid.uuid4()),
+            "id": next(self._next_id),
             "method": method,
             "params": params  # No session_id in params; use header if available
         }
 
+        content = orjson.dumps(payload)
+        client = await _get_client()
+        loop = asyncio.get_running_loop()
         try:
-            response = await self.client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-
-            text = response.text.strip()
-            if text.startswith("event:"):
-                data_lines = [line[5:].strip() for line in text.split("\n") if line.startswith("data:")]
-                data_str = "\n".join(data_lines)
-                return json.loads(data_str)
-            else:
-                return response.json()
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP {e.response.status_code}: {e.response.text}"}
-        except json.JSONDecodeError as e:
-            return {"error": f"JSON decode error: {str(e)} - Response: {response.text}"}
+            async with self._semaphore:
+                # Проверка внутри семафора: запросы, ждавшие очереди, пока предохранитель
+                # размыкался, тоже не должны уходить на сервер
+                if loop.time() < self._breaker_open_until:
+                    return {"error": "Circuit breaker open: сервер не отвечает, запрос не отправлен"}
+                try:
+                    return await self._post(client, content)
+                except (httpx.RemoteProtocolError, httpx.ConnectError):
+                    # Соединение из пула могло быть закрыто сервером за время простоя:
+                    # запрос один раз повторяется, пул откроет новое соединение
+                    return await self._post(client, content)
+        except httpx.TransportError as e:
+            self._record_failure(loop)
+            return {"error": str(e) or type(e).__name__}
+        except orjson.JSONDecodeError as e:
+            return {"error": f"JSON decode error: {str(e)} - Response: {e.doc}"}
         except Exception as e:
             return {"error": str(e)}
 
-    async def list_tools(self) -> types.ListToolsResult:
+    async def _post(self, client: httpx.AsyncClient, content: bytes) -> Dict[str, Any]:
+        """Одна попытка POST на /mcp/request с разбором ответа (см. _send_request)"""
+        self.requests_sent += 1
+        async with client.stream(
+            "POST",
+            self._request_url,
+            content=content,
+            headers=self._headers,
+            timeout=self._request_timeout
+        ) as response:
+            if response.status_code >= 500:
+                self._record_failure(asyncio.get_running_loop())
+
+            if response.is_error:
+                await response.aread()
+                return {"error": f"HTTP {response.status_code}: {response.text}"}
+
+            message = await _read_message(response)
+            # Счётчик сбрасывается только полученным ответом: SSE-транспорт сразу отдаёт
+            # 200 и заголовки, и зависший за прокси сервер проявляется уже при чтении тела
+            self._consecutive_errors = 0
+            return message
+
+    def _record_failure(self, loop: asyncio.AbstractEventLoop):
+        """Учёт сетевой ошибки; при достижении порога размыкает предохранитель.
+
+        Счётчик сбрасывается только успешным ответом, поэтому после паузы
+        первая же ошибка снова размыкает предохранитель.
+        """
+        self._consecutive_errors += 1
+        if self._consecutive_errors >= self.BREAKER_THRESHOLD:
+            self._breaker_open_until = loop.time() + self.BREAKER_COOLDOWN
+
+    async def list_tools(self) -> "types.ListToolsResult":
         """Получение списка инструментов"""
+        from mcp import types
+
         response = await self._make_request("tools/list", {})
         if "error" in response:
             print("[ERROR] list_tools:", response["error"])
             return types.ListToolsResult(tools=[])
 
+        # Отсутствующие description и inputSchema заменяются пустыми значениями до валидации
         tools_data = response.get("result", {}).get("tools", [])
-        tools = [
-            types.Tool(
-                name=t["name"],
-                description=t.get("description", ""),
-                inputSchema=t.get("inputSchema", {})
-            )
-            for t in tools_data
-        ]
-        return types.ListToolsResult(tools=tools)
+        tools = [{"description": "", "inputSchema": {}, **t} for t in tools_data]
+        return types.ListToolsResult.model_validate({"tools": tools})
 
-    async def call_tool(self, name: str, arguments: Dict[str, Any]) -> types.CallToolResult:
-        """Вызов MCP-инструмента"""
+    async def _call_tool_raw(self, name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Вызов MCP-инструмента без построения моделей.
+
+        Возвращает словарь result из ответа JSON-RPC либо {"error": ...} при ошибке.
+        """
         response = await self._make_request("tools/call", {"name": name, "arguments": arguments})
+        return self._tool_call_result(response)
+
+    @staticmethod
+    def _tool_call_result(response: Dict[str, Any]) -> Dict[str, Any]:
         if "error" in response:
+            return {"error": response["error"]}
+        return response.get("result", {})
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any]) -> "types.CallToolResult":
+        """Вызов MCP-инструмента"""
+        from mcp import types
+
+        result_data = await self._call_tool_raw(name, arguments)
+        if "error" in result_data:
             return types.CallToolResult(
-                content=[types.TextContent(type="text", text=f"Error: {response['error']}")],
+                content=[types.TextContent(type="text", text=f"Error: {result_data['error']}")],
                 isError=True
             )
 
-        result_data = response.get("result", {})
-        content_data = result_data.get("content", [])
-        content = []
-        for item in content_data:
-            if item.get("type") == "text":
-                content.append(types.TextContent(type="text", text=item.get("text", "")))
-        return types.CallToolResult(content=content, isError=False)
+        # Валидация всего результата одним вызовом выполняется в pydantic-core,
+        # без поэлементной сборки TextContent в Python
+        content = [item for item in result_data.get("content", []) if item.get("type") == "text"]
+        return types.CallToolResult.model_validate({"content": content, "isError": False})
 
     async def close(self):
-        await self.client.aclose()
+        """Закрывает общий пул соединений текущего цикла событий.
+
+        Пул разделяют все MCPClient цикла, поэтому закрывать его следует после
+        завершения работы с ними; следующий запрос откроет новый пул.
+        """
+        await _close_client()
 
 
 # === Тестовые функции ===
 
+_JSON_START_RE = re.compile(r"\s*[{\[]")
+
+
+def _tool_result_json(raw: Dict[str, Any]):
+    """Разбор результата инструмента для тестов: текст читается прямо из ответа,
+    без построения моделей CallToolResult/TextContent"""
+    if "error" in raw:
+        return {"error": f"Error: {raw['error']}"}
+    content = raw.get("content", [])
+    text = next((item.get("text", "") for item in content if item.get("type") == "text"), "")
+    # Разбирается только текст, похожий на объект или массив JSON: обычный текстовый
+    # ответ не проходит через заведомо неудачный вызов парсера
+    if _JSON_START_RE.match(text):
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return {"result": text}
+
+
+async def _call_tool_json(client: MCPClient, name: str, arguments: Dict[str, Any]):
+    """Вызов инструмента для тестов с разбором результата"""
+    return _tool_result_json(await client._call_tool_raw(name, arguments))
+
+
 async def test_list_metadata_objects(client: MCPClient, meta_type: str, name_mask="", max_items=10):
     """Тестирование инструмента list_metadata_objects"""
     args = {"metaType": meta_type, "nameMask": name_mask, "maxItems": max_items}
-    result = await client.call_tool("list_metadata_objects", args)
-    if result.isError:
-        return {"error": str(result.content[0])}
-    text = result.content[0].text if result.content else ""
-    try:
-        return json.loads(text)
-    except Exception:
-        return {"result": text}
+    return await _call_tool_json(client, "list_metadata_objects", args)
 
 
 async def test_get_metadata_structure(client: MCPClient, meta_type: str, name: str):
     """Тестирование инструмента get_metadata_structure"""
     args = {"metaType": meta_type, "name": name}
-    result = await client.call_tool("get_metadata_structure", args)
-    if result.isError:
-        return {"error": str(result.content[0])}
-    text = result.content[0].text if result.content else ""
-    try:
-        return json.loads(text)
-    except Exception:
-        return {"result": text}
+    return await _call_tool_json(client, "get_metadata_structure", args)
 
 
 async def test_list_predefined_data(client: MCPClient, meta_type: str, name: str, predefined_mask="", max_items=10):
     """Тестирование инструмента list_predefined_data"""
     args = {"metaType": meta_type, "name": name, "predefinedMask": predefined_mask, "maxItems": max_items}
-    result = await client.call_tool("list_predefined_data", args)
-    if result.isError:
-        return {"error": str(result.content[0])}
-    text = result.content[0].text if result.content else ""
-    try:
-        return json.loads(text)
-    except Exception:
-        return {"result": text}
+    return await _call_tool_json(client, "list_predefined_data", args)
 
 
 async def test_get_predefined_data(client: MCPClient, meta_type: str, name: str, predefined_name: str):
     """Тестирование инструмента get_predefined_data"""
     args = {"metaType": meta_type, "name": name, "predefinedName": predefined_name}
-    result = await client.call_tool("get_predefined_data", args)
-    if result.isError:
-        return {"error": str(result.content[0])}
-    text = result.content[0].text if result.content else ""
-    try:
-        return json.loads(text)
-    except Exception:
-        return {"result": text}
+    return await _call_tool_json(client, "get_predefined_data", args)
+
+
+# Сериализатор отчёта с зафиксированными опциями; orjson возвращает UTF-8 bytes,
+# которые пишутся в файл без повторного кодирования
+_log_dumps = functools.partial(orjson.dumps, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+_LOG_RESULT_LABEL = "\nРезультат: ".encode()
+_LOG_SEPARATOR = b"\n" + b"=" * 60 + b"\n"
 
 
-def log_test(test_number, api, params, result):
-    """Запись результатов теста"""
-    output = f"Тест #{test_number}\nAPI: {api}\nПараметры: {json.dumps(params, indent=2, ensure_ascii=False)}\nРезультат: {json.dumps(result, indent=2, ensure_ascii=False)}\n{'='*60}\n"
-    print(output)
-    with open("testMCP.md", "a", encoding="utf-8") as f:
-        f.write(output)
+def log_test(test_number, api, params, result, log_file):
+    """Запись результатов теста в открытый (бинарный) файл отчёта"""
+    # Части записи пишутся по отдельности, без склейки в промежуточную строку
+    parts = (
+        f"Тест #{test_number}\nAPI: {api}\nПараметры: ".encode(),
+        _log_dumps(params),
+        _LOG_RESULT_LABEL,
+        _log_dumps(result),
+        _LOG_SEPARATOR
+    )
+    if VERBOSE:
+        sys.stdout.buffer.writelines(parts)
+    log_file.writelines(parts)
 
 
 # === Основной цикл тестов ===
 
+# Типы метаданных, поддерживающие предопределенные данные
+PREDEFINED_SUPPORTED_TYPES = (
+    "Catalogs", "ChartsOfCharacteristicTypes", "ChartsOfAccounts", "ChartsOfCalculationTypes"
+)
+# Кортеж нужен для rng.choices, множество - для проверок принадлежности в итерациях
+PREDEFINED_SUPPORTED_SET = frozenset(PREDEFINED_SUPPORTED_TYPES)
+
+# Поддерживаемые типы для get_metadata_structure
+STRUCTURE_SUPPORTED_TYPES = frozenset({
+    "Catalogs", "Documents", "InformationRegisters", "AccumulationRegisters",
+    "AccountingRegisters", "CalculationRegisters", "Reports", "DataProcessors",
+    "ChartsOfCharacteristicTypes", "ChartsOfAccounts", "ChartsOfCalculationTypes",
+    "BusinessProcesses", "Tasks", "ExchangePlans"
+})
+
+# Все типы метаданных для случайного выбора
+ALL_TYPES = (
+    "Catalogs", "Documents", "InformationRegisters", "AccumulationRegisters",
+    "AccountingRegisters", "CalculationRegisters", "ChartsOfCharacteristicTypes",
+    "ChartsOfAccounts", "ChartsOfCalculationTypes", "BusinessProcesses", "Tasks",
+    "ExchangePlans", "FilterCriteria", "Reports", "DataProcessors", "Enums",
+    "CommonModules", "SessionParameters", "CommonTemplates", "CommonPictures",
+    "XDTOPackages", "WebServices", "HTTPServices", "WSReferences", "Styles",
+    "Languages", "FunctionalOptions", "FunctionalOptionsParameters", "DefinedTypes",
+    "CommonAttributes", "CommonCommands", "CommandGroups", "Constants",
+    "CommonForms", "Roles", "Subsystems", "EventSubscriptions", "ScheduledJobs",
+    "SettingsStorages", "Sequences", "DocumentJournals", "ExternalDataSources",
+    "Interfaces"
+)
+
+# Маски имён для list_metadata_objects и list_predefined_data
+NAME_MASKS = ("", "Номенклатура", "Документ")
+PREDEFINED_MASKS = ("", "Основной", "Дополнительный")
+
+# Имя объекта из строки списка вида "Тип.Имя (Описание)": часть до "(" без пробелов по краям,
+# после последней точки
+_OBJECT_NAME_RE = re.compile(r"^[^\S\n]*(?:[^(\n]*\.)?([^.(\n]*?)[^\S\n]*(?:\(|$)", re.M)
+
+# Имя предопределённого элемента из строки вида "Имя: 'Основной'" вывода list_predefined_data
+_PREDEFINED_NAME_RE = re.compile(r"^[^\S\n]*Имя: '[^\S\n]*([^'\n]*?)[^\S\n]*(?:'|$)", re.M)
+
+# Признаки ошибки в текстовом результате инструмента (сравнение без учёта регистра)
+ERROR_KEYWORDS = ("ошибка", "исключение", "не найден", "error", "exception", "not found", "вызватьисключение")
+# Все признаки одним регулярным выражением: один проход по тексту без копии в нижнем регистре
+ERROR_RE = re.compile("|".join(map(re.escape, ERROR_KEYWORDS)), re.IGNORECASE)
+
+
+def _classify_result(result) -> str:
+    """Категория результата теста для статистики: "errors", "skipped" или "success"."""
+    # Сначала форма результата: словарь проверяется по ключам, а поиск признаков
+    # ошибки выполняется только для текстового result
+    if isinstance(result, dict):
+        if "error" in result:
+            return "errors"
+        text = result.get("result")
+        if isinstance(text, str):
+            if not text:
+                return "skipped"
+            if ERROR_RE.search(text) is not None:
+                return "errors"
+        return "success"
+    if not result:
+        return "skipped"
+    if "error" in result:
+        return "errors"
+    return "success"
+
+
+def _partial_sample(rng: random.Random, population, k: int) -> list:
+    """k различных случайных элементов population (частичная тасовка Фишера-Йетса).
+
+    Переставленные индексы хранятся в словаре, поэтому выбор стоит O(k)
+    без копирования population.
+    """
+    n = len(population)
+    swapped: Dict[int, int] = {}
+    selected = []
+    for i in range(k):
+        j = rng.randrange(i, n)
+        selected.append(population[swapped.get(j, j)])
+        swapped[j] = swapped.get(i, i)
+    return selected
+
+
 async def run_tests_async():
-    client = MCPClient(BASE_URL, ACCESS_TOKEN)
+    # Файл отчёта открывается один раз на весь прогон; режим "wb" очищает результаты прошлого запуска.
+    # Буфер 1 МБ: записи сбрасываются на диск крупными блоками, а не по одной
+    with open("testMCP.md", "wb", buffering=1 << 20) as log_file:
+        await _run_test_suite(log_file)
+
 
-    if os.path.exists("testMCP.md"):
-        os.remove("testMCP.md")
+async def _run_test_suite(log_file):
+    client = MCPClient(BASE_URL, ACCESS_TOKEN, max_concurrency=CONCURRENCY, use_cache=MEMO)
 
     if not await client.initialize_session():
         print("[ERROR] Не удалось подключиться к MCP серверу")
@@ -240,66 +578,26 @@ async def run_tests_async():
 
     print("[INFO] Подключено к MCP серверу:", BASE_URL)
 
-    # Типы метаданных, поддерживающие предопределенные данные
-    predefined_supported_types = [
-        "Catalogs", "ChartsOfCharacteristicTypes", "ChartsOfAccounts", "ChartsOfCalculationTypes"
-    ]
-
-    # Поддерживаемые типы для get_metadata_structure
-    supported_types_for_structure = [
-        "Catalogs", "Documents", "InformationRegisters", "AccumulationRegisters",
-        "AccountingRegisters", "CalculationRegisters", "Reports", "DataProcessors",
-        "ChartsOfCharacteristicTypes", "ChartsOfAccounts", "ChartsOfCalculationTypes",
-        "BusinessProcesses", "Tasks", "ExchangePlans"
-    ]
-
     methods = ["list_metadata_objects", "get_metadata_structure", "list_predefined_data", "get_predefined_data"]
-    method_stats = {method: {"total": 0, "success": 0, "errors": 0, "skipped": 0} for method in methods}
-    error_keywords = ["ошибка", "исключение", "не найден", "error", "exception", "not found", "вызватьисключение"]
-
-    for i in range(200):
-        test_number = i + 1
-
-        # Шаг 1: Выбрать случайный тип метаданных, приоритет на те, что поддерживают предопределенные данные
-        all_types = [
-            "Catalogs", "Documents", "InformationRegisters", "AccumulationRegisters",
-            "AccountingRegisters", "CalculationRegisters", "ChartsOfCharacteristicTypes",
-            "ChartsOfAccounts", "ChartsOfCalculationTypes", "BusinessProcesses", "Tasks",
-            "ExchangePlans", "FilterCriteria", "Reports", "DataProcessors", "Enums",
-            "CommonModules", "SessionParameters", "CommonTemplates", "CommonPictures",
-            "XDTOPackages", "WebServices", "HTTPServices", "WSReferences", "Styles",
-            "Languages", "FunctionalOptions", "FunctionalOptionsParameters", "DefinedTypes",
-            "CommonAttributes", "CommonCommands", "CommandGroups", "Constants",
-            "CommonForms", "Roles", "Subsystems", "EventSubscriptions", "ScheduledJobs",
-            "SettingsStorages", "Sequences", "DocumentJournals", "ExternalDataSources",
-            "Interfaces"
-        ]
-
-        # 70% шанс выбрать тип с предопределенными данными, 30% - остальные
-        if random.random() < 0.7:
-            meta_type = random.choice(predefined_supported_types)
-        else:
-            meta_type = random.choice(all_types)
+
+    async def run_iteration(meta_type: str, mask: str, max_items: int, predefined_mask: str, seed: int):
+        # У каждой итерации свой генератор: итерации выполняются конкурентно, и общий
+        # генератор выдавал бы значения в порядке завершения запросов, а не итераций
+        rng = random.Random(seed)
+        # Записи (api, params, result) итерации; в отчёт пишутся после завершения всех итераций.
+        # Счётчики (метод, поле) у каждой итерации свои и суммируются после gather
+        records = []
+        stats: Counter = Counter()
 
         # Шаг 2: Получить список объектов этого типа
-        mask = random.choice(["", "Номенклатура", "Документ"])
-        max_items = random.randint(5, 20)
         list_result = await test_list_metadata_objects(client, meta_type, mask, max_items)
-        log_test(test_number, "list_metadata_objects", {"metaType": meta_type, "nameMask": mask, "maxItems": max_items}, list_result)
+        records.append(("list_metadata_objects", {"metaType": meta_type, "nameMask": mask, "maxItems": max_items}, list_result))
 
-        method_stats["list_metadata_objects"]["total"] += 1
-        # Проверяем на ошибки в результате list_metadata_objects
-        if "error" in list_result:
-            method_stats["list_metadata_objects"]["errors"] += 1
-            continue
-        elif isinstance(list_result, dict) and "result" in list_result and isinstance(list_result["result"], str) and any(keyword in list_result["result"].lower() for keyword in error_keywords):
-            method_stats["list_metadata_objects"]["errors"] += 1
-            continue
-        elif (isinstance(list_result, list) and not list_result) or (isinstance(list_result, dict) and "result" in list_result and list_result["result"] == ""):
-            method_stats["list_metadata_objects"]["skipped"] += 1
-            continue
-        else:
-            method_stats["list_metadata_objects"]["success"] += 1
+        outcome = _classify_result(list_result)
+        stats["list_metadata_objects", "total"] += 1
+        stats["list_metadata_objects", outcome] += 1
+        if outcome != "success":
+            return records, stats
 
         # Шаг 3: Если есть объекты, выбрать случайный и получить его структуру
         objects = []
@@ -308,61 +606,47 @@ async def run_tests_async():
         elif isinstance(list_result, dict) and "result" in list_result:
             result_text = list_result["result"]
             if isinstance(result_text, str):
-                for line in result_text.split('\n'):
-                    line = line.strip()
-                    if line:
-                        name = line.split('(')[0].strip() if '(' in line else line.strip()
-                        if '.' in name:
-                            name = name.split('.')[-1]
-                        if name:
-                            objects.append({"name": name})
+                objects = [{"name": match.group(1)} for match in _OBJECT_NAME_RE.finditer(result_text) if match.group(1)]
             elif isinstance(result_text, list):
                 objects = [{"name": obj.split('.')[-1] if '.' in obj else obj} for obj in result_text if obj]
 
         if objects:
-            random_object = random.choice(objects)
+            random_object = rng.choice(objects)
             object_name = random_object.get("name", random_object.get("Name", "")) if isinstance(random_object, dict) else str(random_object)
 
             if object_name:
+                # Шаги 3 и 4 зависят только от (meta_type, object_name), поэтому оба запроса
+                # отправляются сразу, а результаты разбираются в прежнем порядке
+                if meta_type in STRUCTURE_SUPPORTED_TYPES:
+                    structure_task = asyncio.ensure_future(test_get_metadata_structure(client, meta_type, object_name))
+                if meta_type in PREDEFINED_SUPPORTED_SET:
+                    predefined_list_task = asyncio.ensure_future(
+                        test_list_predefined_data(client, meta_type, object_name, predefined_mask, max_items)
+                    )
+
                 # Шаг 3: Получить структуру метаданных, если тип поддерживается
-                if meta_type in supported_types_for_structure:
-                    structure_result = await test_get_metadata_structure(client, meta_type, object_name)
-                    log_test(test_number, "get_metadata_structure", {"metaType": meta_type, "name": object_name}, structure_result)
-
-                    method_stats["get_metadata_structure"]["total"] += 1
-                    # Проверяем на ошибки в результате
-                    if "error" in structure_result:
-                        method_stats["get_metadata_structure"]["errors"] += 1
-                    elif isinstance(structure_result, dict) and "result" in structure_result and isinstance(structure_result["result"], str) and any(keyword in structure_result["result"].lower() for keyword in error_keywords):
-                        method_stats["get_metadata_structure"]["errors"] += 1
-                    elif (isinstance(structure_result, list) and not structure_result) or (isinstance(structure_result, dict) and "result" in structure_result and structure_result["result"] == ""):
-                        method_stats["get_metadata_structure"]["skipped"] += 1
-                    else:
-                        method_stats["get_metadata_structure"]["success"] += 1
+                if meta_type in STRUCTURE_SUPPORTED_TYPES:
+                    structure_result = await structure_task
+                    records.append(("get_metadata_structure", {"metaType": meta_type, "name": object_name}, structure_result))
+
+                    outcome = _classify_result(structure_result)
+                    stats["get_metadata_structure", "total"] += 1
+                    stats["get_metadata_structure", outcome] += 1
                 else:
-                    method_stats["get_metadata_structure"]["total"] += 1
-                    method_stats["get_metadata_structure"]["skipped"] += 1
-                    log_test(test_number, "get_metadata_structure", {"metaType": meta_type, "name": object_name}, {"result": "Skipped: metaType not supported"})
+                    stats["get_metadata_structure", "total"] += 1
+                    stats["get_metadata_structure", "skipped"] += 1
+                    records.append(("get_metadata_structure", {"metaType": meta_type, "name": object_name}, {"result": "Skipped: metaType not supported"}))
 
                 # Шаг 4: Если тип поддерживает предопределенные данные, получить их список
-                if meta_type in predefined_supported_types:
-                    predefined_mask = random.choice(["", "Основной", "Дополнительный"])
-                    predefined_list_result = await test_list_predefined_data(client, meta_type, object_name, predefined_mask, max_items)
-                    log_test(test_number, "list_predefined_data", {"metaType": meta_type, "name": object_name, "predefinedMask": predefined_mask, "maxItems": max_items}, predefined_list_result)
-
-                    method_stats["list_predefined_data"]["total"] += 1
-                    # Проверяем на ошибки в результате
-                    if "error" in predefined_list_result:
-                        method_stats["list_predefined_data"]["errors"] += 1
-                        continue
-                    elif isinstance(predefined_list_result, dict) and "result" in predefined_list_result and isinstance(predefined_list_result["result"], str) and any(keyword in predefined_list_result["result"].lower() for keyword in error_keywords):
-                        method_stats["list_predefined_data"]["errors"] += 1
-                        continue
-                    elif (isinstance(predefined_list_result, list) and not predefined_list_result) or (isinstance(predefined_list_result, dict) and "result" in predefined_list_result and predefined_list_result["result"] == ""):
-                        method_stats["list_predefined_data"]["skipped"] += 1
-                        continue
-                    else:
-                        method_stats["list_predefined_data"]["success"] += 1
+                if meta_type in PREDEFINED_SUPPORTED_SET:
+                    predefined_list_result = await predefined_list_task
+                    records.append(("list_predefined_data", {"metaType": meta_type, "name": object_name, "predefinedMask": predefined_mask, "maxItems": max_items}, predefined_list_result))
+
+                    outcome = _classify_result(predefined_list_result)
+                    stats["list_predefined_data", "total"] += 1
+                    stats["list_predefined_data", outcome] += 1
+                    if outcome != "success":
+                        return records, stats
 
                     # Шаг 5: Если есть предопределенные данные, выбрать несколько случайных и получить их детали
                     predefined_objects = []
@@ -371,77 +655,124 @@ async def run_tests_async():
                     elif isinstance(predefined_list_result, dict) and "result" in predefined_list_result:
                         result_text = predefined_list_result["result"]
                         if isinstance(result_text, str):
-                            for line in result_text.split('\n'):
-                                line = line.strip()
-                                if line and line.startswith("Имя: '"):
-                                    start = len("Имя: '")
-                                    name = line[start:].strip()
-                                    if name:
-                                        predefined_objects.append({"name": name})
+                            predefined_objects = [
+                                {"name": match.group(1)} for match in _PREDEFINED_NAME_RE.finditer(result_text) if match.group(1)
+                            ]
                         elif isinstance(result_text, list):
                             predefined_objects = [{"name": obj.split('.')[-1] if '.' in obj else obj} for obj in result_text if obj]
 
                     if predefined_objects:
                         # Выбираем до 3 случайных предопределенных элементов для тестирования
-                        num_to_test = min(len(predefined_objects), random.randint(1, 3))
-                        selected_predefined = random.sample(predefined_objects, num_to_test)
-
-                        for predefined_item in selected_predefined:
-                            predefined_name = predefined_item.get("name", predefined_item.get("Name", "")) if isinstance(predefined_item, dict) else str(predefined_item)
-
-                            if predefined_name:
-                                predefined_data_result = await test_get_predefined_data(client, meta_type, object_name, predefined_name)
-                                log_test(test_number, "get_predefined_data", {"metaType": meta_type, "name": object_name, "predefinedName": predefined_name}, predefined_data_result)
-
-                                method_stats["get_predefined_data"]["total"] += 1
-                                # Проверяем на ошибки в результате
-                                if "error" in predefined_data_result:
-                                    method_stats["get_predefined_data"]["errors"] += 1
-                                elif isinstance(predefined_data_result, dict) and "result" in predefined_data_result and isinstance(predefined_data_result["result"], str) and any(keyword in predefined_data_result["result"].lower() for keyword in error_keywords):
-                                    method_stats["get_predefined_data"]["errors"] += 1
-                                elif (isinstance(predefined_data_result, list) and not predefined_data_result) or (isinstance(predefined_data_result, dict) and "result" in predefined_data_result and predefined_data_result["result"] == ""):
-                                    method_stats["get_predefined_data"]["skipped"] += 1
-                                else:
-                                    method_stats["get_predefined_data"]["success"] += 1
+                        num_to_test = min(len(predefined_objects), rng.randint(1, 3))
+                        selected_predefined = _partial_sample(rng, predefined_objects, num_to_test)
+
+                        predefined_names = [
+                            predefined_item.get("name", predefined_item.get("Name", "")) if isinstance(predefined_item, dict) else str(predefined_item)
+                            for predefined_item in selected_predefined
+                        ]
+                        predefined_names = [predefined_name for predefined_name in predefined_names if predefined_name]
+
+                        # Streamable HTTP принимает одно JSON-RPC сообщение на POST (batch отклоняется),
+                        # поэтому выбранные элементы запрашиваются отдельными одновременными вызовами
+                        predefined_data_results = await asyncio.gather(*(
+                            test_get_predefined_data(client, meta_type, object_name, predefined_name)
+                            for predefined_name in predefined_names
+                        ))
+
+                        for predefined_name, predefined_data_result in zip(predefined_names, predefined_data_results):
+                            records.append(("get_predefined_data", {"metaType": meta_type, "name": object_name, "predefinedName": predefined_name}, predefined_data_result))
+
+                            outcome = _classify_result(predefined_data_result)
+                            stats["get_predefined_data", "total"] += 1
+                            stats["get_predefined_data", outcome] += 1
+
+        return records, stats
+
+    # Шаг 1: Случайные параметры всех итераций генерируются заранее одним проходом.
+    # При заданном MCP_SEED прогон повторяет те же параметры и выбор объектов
+    rng = random.Random(SEED)
+    if SEED is not None:
+        print(f"[INFO] MCP_SEED={SEED}")
+    # Тип метаданных: 70% шанс выбрать тип с предопределенными данными, 30% - любой из остальных
+    test_count = 200
+    preferred_types = rng.choices(PREDEFINED_SUPPORTED_TYPES, k=test_count)
+    other_types = rng.choices(ALL_TYPES, k=test_count)
+    meta_types = [
+        preferred if rng.random() < 0.7 else other
+        for preferred, other in zip(preferred_types, other_types)
+    ]
+    masks = rng.choices(NAME_MASKS, k=test_count)
+    max_items_list = [rng.randint(5, 20) for _ in range(test_count)]
+    predefined_masks = rng.choices(PREDEFINED_MASKS, k=test_count)
+    iteration_seeds = [rng.getrandbits(64) for _ in range(test_count)]
+    plans = list(zip(meta_types, masks, max_items_list, predefined_masks, iteration_seeds))
+
+    # Итерации независимы и выполняются конкурентно, каждая проходит свои шаги
+    # по мере готовности данных. Число одновременных запросов к серверу ограничивает
+    # семафор MCPClient, а не число итераций. Одинаковые запросы list_metadata_objects
+    # разных итераций объединяет кэш MCPClient (если он не отключён MCP_MEMO=0)
+    iteration_results = await asyncio.gather(*(run_iteration(*plan) for plan in plans))
+    method_stats = sum((stats for _, stats in iteration_results), Counter())
+
+    # Отчёт пишется одним проходом после сетевой части и в порядке номеров тестов,
+    # независимо от того, в каком порядке завершались итерации
+    # Текстовый буфер stdout сбрасывается заранее, чтобы вывод print не перемешался
+    # с записями, которые log_test пишет напрямую в sys.stdout.buffer
+    sys.stdout.flush()
+    for test_number, (records, _) in enumerate(iteration_results, 1):
+        for api, params, result in records:
+            log_test(test_number, api, params, result, log_file)
+    sys.stdout.flush()
 
     await client.close()
 
     # Вывод сводной статистики в MD таблице
     summary = "## Сводная статистика тестов\n\n"
-    summary += "| Метод                  | Всего | Успешно | Ошибка | Пропущено | Процент успеха |\n"
-    summary += "|------------------------|------:|--------:|-------:|----------:|---------------:|\n"
+    # "Из кэша" - сколько вызовов из "Всего" получили ответ из кэша MCPClient,
+    # не обращаясь к серверу (отключается MCP_MEMO=0)
+    summary += "| Метод                  | Всего | Из кэша | Успешно | Ошибка | Пропущено | Процент успеха |\n"
+    summary += "|------------------------|------:|--------:|--------:|-------:|----------:|---------------:|\n"
 
     total_all = 0
+    total_cached = 0
     total_success = 0
     total_errors = 0
     total_skipped = 0
 
     for method in methods:
-        stats = method_stats[method]
-        total = stats['total']
-        success = stats['success']
-        errors = stats['errors']
-        skipped = stats['skipped']
+        total = method_stats[method, "total"]
+        success = method_stats[method, "success"]
+        errors = method_stats[method, "errors"]
+        skipped = method_stats[method, "skipped"]
+        cached = client.cache_hits[method]
         success_rate = (success / total * 100) if total > 0 else 0
 
-        summary += f"| {method:<22} | {total:>5} | {success:>7} | {errors:>6} | {skipped:>9} | {success_rate:>13.1f}% |\n"
+        summary += f"| {method:<22} | {total:>5} | {cached:>7} | {success:>7} | {errors:>6} | {skipped:>9} | {success_rate:>13.1f}% |\n"
 
         total_all += total
+        total_cached += cached
         total_success += success
         total_errors += errors
         total_skipped += skipped
 
     overall_success_rate = (total_success / total_all * 100) if total_all > 0 else 0
-    summary += f"| Итого                  | {total_all:>5} | {total_success:>7} | {total_errors:>6} | {total_skipped:>9} | {overall_success_rate:>13.1f}% |\n\n"
+    summary += f"| Итого                  | {total_all:>5} | {total_cached:>7} | {total_success:>7} | {total_errors:>6} | {total_skipped:>9} | {overall_success_rate:>13.1f}% |\n\n"
+    summary += f"Запросов к серверу: {client.requests_sent}, ответов из кэша: {total_cached}\n\n"
 
     summary += "[INFO] Тестирование завершено.\n"
     print(summary)
-    with open("testMCP.md", "a", encoding="utf-8") as f:
-        f.write(summary)
+    log_file.write(summary.encode())
 
 
 def run_tests():
-    asyncio.run(run_tests_async())
+    if uvloop is None:
+        asyncio.run(run_tests_async())
+    elif sys.version_info >= (3, 11) and hasattr(uvloop, "run"):
+        uvloop.run(run_tests_async())
+    else:
+        # uvloop.run есть с uvloop 0.18 и требует Python 3.11+; иначе цикл ставится через политику
+        uvloop.install()
+        asyncio.run(run_tests_async())
 
 
 if __name__ == "__main__":